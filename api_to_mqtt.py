@@ -1,33 +1,90 @@
-import requests
+import httpx
 import json
+import re
 import time
 import os
+import gzip
+import shutil
 import threading
+import sched
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import queue
+import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 import paho.mqtt.client as mqtt
 
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
 # ==========================================
 # --- GLOBAL SETTINGS ---
 # ==========================================
 CONFIG_FILENAME = "config.json"
 LOG_DIR = "logs" 
 LOG_LOCK = threading.Lock() 
-MAX_LOG_LINES = 50000  # Rolling buffer limit
+LOG_MAX_BYTES = 4_000_000  # Rotate each log file at ~4 MB
+LOG_BACKUP_COUNT = 3  # Rotated files kept per log
+LOG_BATCH_MAX = 256  # Records buffered per log file before a write is forced (under IOV_MAX)
+LOG_PAYLOAD_MAX_CHARS = 2048  # JSON payloads longer than this are logged head+tail only
+LOG_FULL_PAYLOADS = os.environ.get("API_TO_MQTT_DEBUG") == "1"  # Log whole payloads, pretty-printed
+MQTT_CLIENTS = []  # Every live broker connection, closed on shutdown
+MQTT_CLIENTS_LOCK = threading.Lock()
 
 # API Endpoints
 LOGIN_URL = "https://airquality.aqi.in/api/v1/login"
 DEVICE_URL = "https://airquality.aqi.in/api/v1/GetAllUserDevices"
-
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+RETRY_STATUSES = {502, 503, 504}  # Device fetches answered with these are retried
+HTTP_STATUS_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.3  # Seconds, doubled on every retry
+RAW_LOG_LIMIT = 2048  # Bytes of a non-JSON response body kept in the logs
+
+# Exact mapping from API Sensor Name to Pico Target Key
+SENSOR_MAP = {
+    "PM25": "PM25",
+    "PM10": "PM10",
+    "Temp(cel)": "TEMP",
+    "Hum": "HUM"
+}
+TARGET_ORDER = ("PM25", "PM10", "TEMP", "HUM")  # Key order the Pico W parses
+DATE_FMT = "DATE:%Y-%m-%d,%H:%M:%S"
+REPUBLISH_EVERY = 6  # Unchanged readings are still published every Nth tick (per-job "republish_every")
+
+UNSAFE_NAME_CHARS = re.compile(r"[^\w. ]")  # Stripped from job names to build log folder names
+_loggers = {}  # (job_name, log_type) -> logging.Logger, created under LOG_LOCK
+_file_handlers = {}  # logger name -> AppendFileHandler, used by the log writer thread
+LOG_QUEUE = queue.SimpleQueue()  # Records waiting for the log writer thread
+
+os.makedirs(LOG_DIR, exist_ok=True)
+
+def json_loads(data):
+    """Parses JSON bytes/str with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps_compact(obj):
+    """Serializes without whitespace, with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+def json_dumps_pretty(obj):
+    """Serializes a payload for the logs with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(obj, indent=4)
 
 def load_config():
     if not os.path.exists(CONFIG_FILENAME):
         print(f"CRITICAL ERROR: {CONFIG_FILENAME} not found.")
         return []
     try:
-        with open(CONFIG_FILENAME, 'r') as f:
-            return json.load(f)
+        with open(CONFIG_FILENAME, 'rb') as f:
+            return json_loads(f.read())
     except Exception as e:
         print(f"CRITICAL ERROR: Could not parse {CONFIG_FILENAME}. {e}")
         return []
@@ -35,66 +92,245 @@ def load_config():
 # ==========================================
 # --- TIERED LOGGING SYSTEM ---
 # ==========================================
-def log_to_file(job_name, log_type, event_type, details, payload=None):
+def summarize_payload(payload, max_chars=LOG_PAYLOAD_MAX_CHARS):
     """
-    log_type: "info" or "error"
+    Compact JSON of the payload, cut down to its head and tail when longer
+    than max_chars so a large device list doesn't bloat every log entry.
     """
-    with LOG_LOCK:
+    payload_str = json_dumps_compact(payload)
+    if len(payload_str) <= max_chars:
+        return payload_str
+    half = max_chars // 2
+    omitted = len(payload_str) - 2 * half
+    return f"{payload_str[:half]}...[{omitted} chars omitted]...{payload_str[-half:]}"
+
+class PayloadFormatter(logging.Formatter):
+    """
+    Renders "[timestamp] EVENT | details" and, when the record carries one,
+    the structured payload block underneath it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_second = None
+        self._cached_time = None
+
+    def formatTime(self, record, datefmt=None):
+        # Timestamps only have second resolution, so format each second once
+        second = int(record.created)
+        if second != self._cached_second:
+            self._cached_time = super().formatTime(record, datefmt)
+            self._cached_second = second
+        return self._cached_time
+
+    def format(self, record):
+        log_entry = super().format(record)
+        payload = getattr(record, 'payload', None)
+
+        if payload is not None:
+            if isinstance(payload, (dict, list)):
+                payload_str = json_dumps_pretty(payload) if LOG_FULL_PAYLOADS else summarize_payload(payload)
+            else:
+                payload_str = str(payload)
+            log_entry += f"\n--- PAYLOAD ---\n{payload_str}\n----------------"
+        return log_entry
+
+def gzip_namer(name):
+    return name + ".gz"
+
+def gzip_rotator(source, dest):
+    """Compresses a rotated log into dest; level 1 keeps the CPU cost low."""
+    with open(source, 'rb') as src, gzip.open(dest, 'wb', compresslevel=1) as dst:
+        shutil.copyfileobj(src, dst, length=1 << 16)
+    os.remove(source)
+
+class AppendFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler writing encoded records to an unbuffered O_APPEND
+    file, skipping the TextIOWrapper layer. Records are collected in memory
+    and flush() writes the whole batch with a single writev(2).
+    The file size is tracked in memory instead of re-checked per record.
+    """
+    def __init__(self, *args, **kwargs):
+        self._pending = []
+        super().__init__(*args, **kwargs)
+
+    def _open(self):
+        stream = open(self.baseFilename, 'ab', buffering=0)
+        self._size = os.fstat(stream.fileno()).st_size
+        return stream
+
+    def emit(self, record):
         try:
+            data = (self.format(record) + self.terminator).encode(self.encoding or 'utf-8')
+            if self.stream is None:
+                self.stream = self._open()
+
+            if self.maxBytes > 0 and self._size > 0 and self._size + len(data) >= self.maxBytes:
+                self.flush()
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+
+            self._pending.append(data)
+            self._size += len(data)
+            if len(self._pending) >= LOG_BATCH_MAX:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            if not self._pending or self.stream is None:
+                return
+            pending, self._pending = self._pending, []
+            fd = self.stream.fileno()
+            try:
+                # Windows has no writev; the loop below then writes everything
+                written = os.writev(fd, pending) if hasattr(os, 'writev') else 0
+
+                # A short write (e.g. disk almost full) must not drop the rest
+                remaining = b""
+                if written < sum(map(len, pending)):
+                    remaining = memoryview(b"".join(pending))[written:]
+                while remaining:
+                    count = os.write(fd, remaining)
+                    if count == 0:
+                        raise OSError(f"write stalled with {len(remaining)} bytes left")
+                    remaining = remaining[count:]
+            except OSError as e:
+                self._size = os.fstat(fd).st_size
+                print(f"Logging Error for {self.baseFilename}: {e}")
+
+class LogRouter(QueueListener):
+    """
+    Background writer for LOG_QUEUE. Each record goes to the file handler
+    of the logger that produced it, so job threads only pay for an enqueue
+    and never block on disk I/O. Handlers are flushed once the queue runs
+    dry, so a tick's burst of records lands in one write per file.
+    """
+    def __init__(self, queue):
+        super().__init__(queue)
+        self._dirty = set()
+
+    def handle(self, record):
+        handler = _file_handlers.get(record.name)
+        if handler is not None:
+            handler.handle(self.prepare(record))
+            self._dirty.add(handler)
+
+        if self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        while self._dirty:
+            self._dirty.pop().flush()
+
+    def stop(self):
+        super().stop()
+        self.flush()
+
+LOG_LISTENER = LogRouter(LOG_QUEUE)
+
+def sanitize_job_name(job_name):
+    """Folder-safe job name: keeps letters, digits, '.', '_' and turns spaces into '_'."""
+    return UNSAFE_NAME_CHARS.sub("", job_name).strip().replace(" ", "_")
+
+def get_logger(job_name, log_type):
+    """
+    Returns the cached logger for logs/[job_name]/[log_type].log.
+    Records go through LOG_QUEUE to an AppendFileHandler, which keeps
+    the file open and rotates by renaming.
+    """
+    key = (job_name, log_type)
+    logger = _loggers.get(key)
+    if logger is not None:
+        return logger
+
+    with LOG_LOCK:
+        if key in _loggers:
+            return _loggers[key]
+
+        # Job names that sanitize to the same folder share one logger and one
+        # file handler, so each record is still queued and written only once
+        safe_name = sanitize_job_name(job_name)
+        logger = logging.getLogger(f"api_to_mqtt.{safe_name}.{log_type}")
+
+        if logger.name not in _file_handlers:
             # Create job-specific folder
-            safe_name = "".join([c for c in job_name if c.isalnum() or c in (' ', '.', '_')]).strip().replace(" ", "_")
             job_dir = os.path.join(LOG_DIR, safe_name)
-            if not os.path.exists(job_dir):
-                os.makedirs(job_dir)
+            os.makedirs(job_dir, exist_ok=True)
 
             log_path = os.path.join(job_dir, f"{log_type}.log")
+            handler = AppendFileHandler(log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+            handler.namer = gzip_namer
+            handler.rotator = gzip_rotator
+            handler.setFormatter(PayloadFormatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
 
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_entry = f"[{timestamp}] {event_type} | {details}"
-            
-            if payload is not None:
-                if isinstance(payload, (dict, list)):
-                    payload_str = json.dumps(payload, indent=4)
-                else:
-                    payload_str = str(payload)
-                log_entry += f"\n--- PAYLOAD ---\n{payload_str}\n----------------"
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(QueueHandler(LOG_QUEUE))
+            _file_handlers[logger.name] = handler
 
-            # Read existing lines to manage rolling buffer
-            lines = []
-            if os.path.exists(log_path):
-                with open(log_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
+        _loggers[key] = logger
+        return logger
 
-            lines.append(log_entry + "\n")
-
-            # Rolling Cycle: keep only the most recent 50k lines
-            if len(lines) > MAX_LOG_LINES:
-                lines = lines[-MAX_LOG_LINES:]
-
-            with open(log_path, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
-            
-        except Exception as e:
-            print(f"Logging Error for {job_name}: {e}")
+def log_to_file(job_name, log_type, event_type, details, payload=None):
+    """
+    log_type: "info" or "error"
+    """
+    logger = get_logger(job_name, log_type)
+    level = logging.ERROR if log_type == "error" else logging.INFO
+    logger.log(level, "%s | %s", event_type, details, extra={'payload': payload})
 
 # ==========================================
 # --- AUTH & API FUNCTIONS ---
 # ==========================================
-def get_api_token(email, password, job_name):
+def create_session():
+    """
+    Builds a keep-alive HTTP/2 client so the login and device fetch
+    calls share one TCP/TLS connection across loop iterations.
+    """
+    limits = httpx.Limits(max_keepalive_connections=10, keepalive_expiry=300)
+    transport = httpx.HTTPTransport(http2=True, retries=2, limits=limits)
+    return httpx.Client(transport=transport, timeout=15.0, follow_redirects=True)
+
+def get_with_retry(session, url, **kwargs):
+    """
+    GET that retries transient 502/503/504 answers with a short backoff;
+    the transport itself only retries failed connects.
+    """
+    for attempt in range(HTTP_STATUS_RETRIES):
+        response = session.get(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES:
+            return response
+        time.sleep(HTTP_RETRY_BACKOFF * (2 ** attempt))
+    return session.get(url, **kwargs)
+
+def raw_excerpt(response):
+    """
+    Decodes only the head of a non-JSON body for the error logs, skipping
+    the full decode that response.text would do.
+    """
+    return response.content[:RAW_LOG_LIMIT].decode('utf-8', errors='replace')
+
+def get_api_token(session, email, password, job_name):
     try:
         request_payload = {'email': email, 'password': password}
         log_to_file(job_name, "info", "API_LOGIN_REQUEST", f"URL: {LOGIN_URL}", request_payload)
 
-        response = requests.post(LOGIN_URL, data=request_payload, timeout=15)
+        response = session.post(LOGIN_URL, data=request_payload, timeout=15)
         
         try:
-            response_json = response.json()
+            response_json = json_loads(response.content)
         except:
-            response_json = f"RAW_RESPONSE: {response.text}"
+            response_json = f"RAW_RESPONSE: {raw_excerpt(response)}"
 
         if response.status_code == 200:
             log_to_file(job_name, "info", "API_LOGIN_SUCCESS", f"Status: {response.status_code}", response_json)
-            return response_json.get('token')
+            token = response_json.get('token')
+            if token:
+                session.headers.update({'Authorization': f'bearer {token}'})
+            return token
         else:
             log_to_file(job_name, "error", "AUTH_FAILED", f"Status: {response.status_code}", response_json)
             
@@ -102,158 +338,297 @@ def get_api_token(email, password, job_name):
         log_to_file(job_name, "error", "AUTH_EXCEPTION", str(e))
     return None
 
-def format_mqtt_string(device_data):
+def index_sensors(realtime_sensors):
+    """
+    Returns ((target_key, position), ...) in TARGET_ORDER for the sensors we publish.
+    If a sensor name repeats, the last one wins.
+    """
+    positions = {}
+    for i, sensor in enumerate(realtime_sensors):
+        target_key = SENSOR_MAP.get(sensor.get('sensorname'))
+        if target_key:
+            positions[target_key] = i
+    return tuple((key, positions[key]) for key in TARGET_ORDER if key in positions)
+
+def format_mqtt_string(device_data, date_tag=None, sensor_cache=None):
     """
     Extracts only PM25, PM10, TEMP, and HUM from the device data
     using the specific keys from the API: "PM25", "PM10", "Temp(cel)", "Hum".
     Formats them as KEY:VALUE strings for the Pico W.
+    date_tag: the tick's "DATE:..." stamp, computed once by the caller.
+    sensor_cache: optional per-job dict remembering where each device's sensors sit.
     """
     try:
         realtime_sensors = device_data.get('realtime', [])
-        found_data = {}
-
-        # Define the exact mapping from API Sensor Name to Pico Target Key
-        sensor_map = {
-            "PM25": "PM25",
-            "PM10": "PM10",
-            "Temp(cel)": "TEMP",
-            "Hum": "HUM"
-        }
-
-        # 1. Extract sensor data
-        for sensor in realtime_sensors:
-            api_name = sensor.get('sensorname')
-            value = sensor.get('sensorvalue', 0)
-
-            if api_name in sensor_map:
-                target_key = sensor_map[api_name]
-                found_data[target_key] = value
-
-        # 2. Construct the data string in the specific order requested
-        # The Pico W code expects keys: PM25, PM10, TEMP, HUM
-        target_order = ["PM25", "PM10", "TEMP", "HUM"]
-        data_parts = []
-
-        for key in target_order:
-            if key in found_data:
-                data_parts.append(f"{key}:{found_data[key]}")
+
+        # 1. Locate the sensors we publish; a device's sensor list rarely changes,
+        # so reuse the last positions while they still line up
+        if sensor_cache is None:
+            sensor_index = index_sensors(realtime_sensors)
+        else:
+            device_id = device_data.get('serialNo') or device_data.get('devicename')
+            cached = sensor_cache.get(device_id)
+            if (cached is None or cached[0] != len(realtime_sensors)
+                    or any(SENSOR_MAP.get(realtime_sensors[i].get('sensorname')) != key for key, i in cached[1])):
+                cached = (len(realtime_sensors), index_sensors(realtime_sensors))
+                sensor_cache[device_id] = cached
+            sensor_index = cached[1]
+
+        # 2. Construct the data string in the order the Pico W expects
+        data_parts = [f"{key}:{realtime_sensors[i].get('sensorvalue', 0)}" for key, i in sensor_index]
 
         # If none of the relevant sensors were found, return None to skip publishing
         if not data_parts:
             return None
 
         # 3. Add Timestamp (preserved as requested)
-        now = datetime.now()
-        date_str = now.strftime("DATE:%Y-%m-%d,%H:%M:%S")
-        
-        return ",".join(data_parts) + "," + date_str
+        if date_tag is None:
+            date_tag = datetime.now().strftime(DATE_FMT)
+        return ",".join(data_parts) + "," + date_tag
 
     except Exception as e:
         # In case of parsing error, return None
         return None
 
-def publish_mqtt(payload, mqtt_config, job_name):
+def get_mqtt_client(mqtt_clients, mqtt_config, job_name):
+    """
+    Returns the job's long-lived client for this broker, connecting on first use.
+    The paho network thread (loop_start) keeps the connection alive and
+    reconnects automatically if the broker drops it.
+    """
     broker = mqtt_config.get('broker')
     port = mqtt_config.get('port', 1883)
     user = mqtt_config.get('username')
     pw = mqtt_config.get('password')
+
+    key = (broker, port, user)
+    client = mqtt_clients.get(key)
+    if client is not None:
+        return client
+
+    # Explicitly specify CallbackAPIVersion to remove DeprecationWarning.
+    # An empty client_id makes paho generate a random one, so no two jobs or
+    # bridge instances on the same broker can kick each other off. Publishes
+    # are QoS 0, so a persistent broker session would buy nothing anyway.
+    client = mqtt.Client(
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        client_id="",
+        clean_session=True,
+    )
+    if user and pw:
+        client.username_pw_set(user, pw)
+
+    def on_disconnect(client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            log_to_file(job_name, "error", "MQTT_DISCONNECTED", f"Broker: {broker}", str(reason_code))
+
+    client.on_disconnect = on_disconnect
+    client.connect(broker, port, keepalive=60)
+    client.loop_start()
+
+    mqtt_clients[key] = client
+    with MQTT_CLIENTS_LOCK:
+        MQTT_CLIENTS.append(client)
+    return client
+
+def close_mqtt_clients():
+    with MQTT_CLIENTS_LOCK:
+        for client in MQTT_CLIENTS:
+            client.disconnect()
+            client.loop_stop()
+        MQTT_CLIENTS.clear()
+
+def publish_mqtt(payload, mqtt_config, job_name, mqtt_clients):
+    broker = mqtt_config.get('broker')
     topic = mqtt_config.get('topic')
 
-    # Explicitly specify CallbackAPIVersion to remove DeprecationWarning
     try:
-        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
-        if user and pw:
-            client.username_pw_set(user, pw)
-        
-        client.connect(broker, port, 60)
-        client.publish(topic, payload)
-        client.disconnect()
-        return True
+        client = get_mqtt_client(mqtt_clients, mqtt_config, job_name)
+        info = client.publish(topic, payload, qos=0)
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
     except Exception as e:
         log_to_file(job_name, "error", "MQTT_CONNECTION_ERROR", f"Broker: {broker}", str(e))
         return False
 
-def run_job(job_config):
+@dataclass
+class JobState:
+    """Everything a job carries from one tick to the next."""
+    name: str
+    interval: float
+    api_conf: dict
+    rules_by_device: dict
+    republish_every: int
+    session: httpx.Client = field(default_factory=create_session)
+    mqtt_clients: dict = field(default_factory=dict)
+    token: str | None = None
+    next_tick: float = field(default_factory=time.monotonic)
+    future: Future | None = None  # The tick currently running on the pool, if any
+    last_readings: dict = field(default_factory=dict)  # device name -> (readings, unchanged ticks skipped)
+    sensor_cache: dict = field(default_factory=dict)  # device id -> (sensor count, sensor positions)
+
+def create_job_state(job_config):
+    # Index mapping rules by device name once; a device may feed several topics
+    rules_by_device = {}
+    for map_rule in job_config.get('device_mappings', []):
+        rules_by_device.setdefault(map_rule.get('device_name'), []).append(map_rule)
+
     name = job_config.get('job_name', 'Unnamed')
-    interval = job_config.get('interval', 10)
-    api_conf = job_config['api']
-    mappings = job_config.get('device_mappings', [])
-
-    token = None
-    
-    while True:
-        loop_start = time.time()
-        
-        if not token:
-            token = get_api_token(api_conf['email'], api_conf['password'], name)
-            if not token:
-                time.sleep(10)
-                continue
+    api_conf = job_config.get('api') or {}
+    if not api_conf.get('email') or not api_conf.get('password'):
+        raise ValueError(f"job '{name}' has no api email/password")
+
+    # Set up the job's log folder and loggers up front, off the tick path
+    for log_type in ("info", "error"):
+        get_logger(name, log_type)
+
+    return JobState(
+        name=name,
+        interval=job_config.get('interval', 10),
+        api_conf=api_conf,
+        rules_by_device=rules_by_device,
+        republish_every=job_config.get('republish_every', REPUBLISH_EVERY),
+    )
+
+def fetch_and_publish(state):
+    """
+    Fetches the device list and publishes every mapped device.
+    Returns False only when the token expired and the caller should re-authenticate.
+    """
+    name = state.name
 
+    try:
+        log_to_file(name, "info", "API_DEVICE_FETCH_REQUEST", f"URL: {DEVICE_URL}")
+        
+        response = get_with_retry(state.session, DEVICE_URL, timeout=15)
+        
         try:
-            headers = {'Authorization': f'bearer {token}'}
-            log_to_file(name, "info", "API_DEVICE_FETCH_REQUEST", f"URL: {DEVICE_URL}")
-            
-            response = requests.get(DEVICE_URL, headers=headers, timeout=15)
-            
-            try:
-                resp_data = response.json()
-            except:
-                resp_data = f"RAW_NON_JSON_CONTENT: {response.text}"
+            resp_data = json_loads(response.content)
+        except:
+            resp_data = f"RAW_NON_JSON_CONTENT: {raw_excerpt(response)}"
+        
+        if response.status_code == 200:
+            log_to_file(name, "info", "API_DEVICE_FETCH_RESPONSE", "Full Device List Received", resp_data)
             
-            if response.status_code == 200:
-                log_to_file(name, "info", "API_DEVICE_FETCH_RESPONSE", "Full Device List Received", resp_data)
-                
-                devices_list = resp_data.get('data', []) if isinstance(resp_data, dict) else []
-
-                for device in devices_list:
-                    dev_name = device.get('devicename', '')
-                    
-                    for map_rule in mappings:
-                        target_name = map_rule.get('device_name')
-                        mqtt_conf = map_rule.get('mqtt', {})
-                        
-                        if dev_name == target_name:
-                            payload = format_mqtt_string(device)
-                            if payload:
-                                if publish_mqtt(payload, mqtt_conf, name):
-                                    log_to_file(name, "info", "MQTT_PUBLISH_SUCCESS", f"Topic: {mqtt_conf.get('topic')}", payload)
-                                else:
-                                    log_to_file(name, "error", "MQTT_PUBLISH_FAILURE", f"Failed to send to {mqtt_conf.get('topic')}", payload)
-                            else:
-                                log_to_file(name, "error", "FORMAT_ERROR", f"No matching sensor data found for {dev_name}")
+            devices_list = resp_data.get('data', []) if isinstance(resp_data, dict) else []
+
+            # 1. Format every matching device first...
+            date_tag = datetime.now().strftime(DATE_FMT)
+            outgoing = []
+            for device in devices_list:
+                dev_name = device.get('devicename', '')
+                rules = state.rules_by_device.get(dev_name)
+                if not rules:
+                    continue
+
+                payload = format_mqtt_string(device, date_tag, state.sensor_cache)
+                if not payload:
+                    log_to_file(name, "error", "FORMAT_ERROR", f"No matching sensor data found for {dev_name}")
+                    continue
+
+                # Skip devices whose readings (ignoring the timestamp) haven't changed,
+                # but still republish every `republish_every` ticks as a heartbeat
+                readings = payload.rpartition(",DATE:")[0]
+                previous = state.last_readings.get(dev_name)
+                if previous is not None and previous[0] == readings and previous[1] + 1 < state.republish_every:
+                    state.last_readings[dev_name] = (readings, previous[1] + 1)
+                    continue
+                state.last_readings[dev_name] = (readings, 0)
+
+                for map_rule in rules:
+                    outgoing.append((dev_name, payload, map_rule.get('mqtt', {})))
+
+            # 2. ...then publish them back to back, keeping formatting and log
+            # calls out from between publishes (paho still sends each PUBLISH
+            # packet with its own socket write)
+            results = [publish_mqtt(payload, mqtt_conf, name, state.mqtt_clients) for _, payload, mqtt_conf in outgoing]
+
+            for (dev_name, payload, mqtt_conf), published in zip(outgoing, results):
+                if published:
+                    log_to_file(name, "info", "MQTT_PUBLISH_SUCCESS", f"Topic: {mqtt_conf.get('topic')}", payload)
+                else:
+                    log_to_file(name, "error", "MQTT_PUBLISH_FAILURE", f"Failed to send to {mqtt_conf.get('topic')}", payload)
+                    # Forget the readings so the next tick retries even if nothing changed
+                    state.last_readings.pop(dev_name, None)
+        
+        elif response.status_code == 401:
+            log_to_file(name, "error", "API_TOKEN_EXPIRED", "401 Unauthorized - Re-authenticating...")
+            state.token = None
+            return False
+        else:
+            log_to_file(name, "error", "API_FETCH_ERROR", f"Status {response.status_code}", resp_data)
             
-            elif response.status_code == 401:
-                log_to_file(name, "error", "API_TOKEN_EXPIRED", "401 Unauthorized - Re-authenticating...")
-                token = None
-                continue
-            else:
-                log_to_file(name, "error", "API_FETCH_ERROR", f"Status {response.status_code}", resp_data)
-                
-        except Exception as e:
-            log_to_file(name, "error", "CRITICAL_LOOP_EXCEPTION", str(e))
-            token = None
+    except Exception as e:
+        log_to_file(name, "error", "CRITICAL_LOOP_EXCEPTION", str(e))
+        state.token = None
+    return True
 
-        elapsed = time.time() - loop_start
-        time.sleep(max(0, interval - elapsed))
+def run_tick(state):
+    """One login (if needed) -> fetch -> publish cycle. A 401 re-authenticates and retries once."""
+    # Nothing reads the Future's result, so anything escaping here would vanish silently
+    try:
+        for _ in range(2):
+            if not state.token:
+                state.token = get_api_token(state.session, state.api_conf['email'], state.api_conf['password'], state.name)
+                if not state.token:
+                    return
+
+            if fetch_and_publish(state):
+                return
+    except Exception as e:
+        log_to_file(state.name, "error", "CRITICAL_LOOP_EXCEPTION", repr(e))
+        state.token = None
+
+def schedule_tick(scheduler, executor, state):
+    # Hand the tick to the pool, unless the previous one is still running
+    if state.future is None or state.future.done():
+        state.future = executor.submit(run_tick, state)
+    else:
+        log_to_file(state.name, "error", "TICK_OVERRUN", f"Previous tick still running after {state.interval}s, skipping")
+
+    # Schedule on the monotonic clock so NTP/DST jumps can't skew the interval.
+    # If we fell more than a whole interval behind, skip ahead instead of
+    # firing a burst of catch-up ticks.
+    state.next_tick += state.interval
+    now = time.monotonic()
+    if now - state.next_tick > state.interval:
+        state.next_tick = now + state.interval
+    scheduler.enterabs(state.next_tick, 0, schedule_tick, (scheduler, executor, state))
 
 def main():
     config = load_config()
     if not config: return
 
-    threads = []
-    for job in config:
-        if job.get('enabled', True):
-            t = threading.Thread(target=run_job, args=(job,))
-            t.daemon = True
-            t.start()
-            threads.append(t)
+    LOG_LISTENER.start()
+
+    # A broken job entry is skipped so it can't take the other jobs down with it
+    jobs = []
+    for index, job in enumerate(config):
+        try:
+            if job.get('enabled', True):
+                jobs.append(create_job_state(job))
+        except Exception as e:
+            print(f"ERROR: Skipping job #{index} in {CONFIG_FILENAME}: {e!r}")
+
+    if not jobs:
+        LOG_LISTENER.stop()
+        return
+
+    # One scheduler (this thread) hands job ticks to a small shared pool
+    scheduler = sched.scheduler(time.monotonic, time.sleep)
+    executor = ThreadPoolExecutor(max_workers=min(32, len(jobs)), thread_name_prefix="job")
+    for state in jobs:
+        scheduler.enterabs(state.next_tick, 0, schedule_tick, (scheduler, executor, state))
 
-    print(f"--- Running {len(threads)} jobs. Separate logs in 'logs/[job_name]/' folder. ---")
+    print(f"--- Running {len(jobs)} jobs. Separate logs in 'logs/[job_name]/' folder. ---")
     try:
-        while True: time.sleep(1)
+        scheduler.run()
     except KeyboardInterrupt:
         print("\nShutting down...")
+        # Let running ticks finish first so they can't open MQTT clients or
+        # queue log records after those have been shut down
+        executor.shutdown(wait=True, cancel_futures=True)
+        close_mqtt_clients()
+        LOG_LISTENER.stop()
 
 if __name__ == "__main__":
     main()
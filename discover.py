@@ -1,11 +1,15 @@
-import requests
+import httpx
 import json
 import os
+import time
 
 # --- SETTINGS ---
 CONFIG_FILENAME = "config.json"
 LOGIN_URL = "https://airquality.aqi.in/api/v1/login"
 DEVICE_URL = "https://airquality.aqi.in/api/v1/GetAllUserDevices"
+RETRY_STATUSES = {502, 503, 504}
+HTTP_STATUS_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.3  # Seconds, doubled on every retry
 
 def load_config():
     """Loads the list of jobs from config.json."""
@@ -19,7 +23,25 @@ def load_config():
         print(f"ERROR: Could not parse {CONFIG_FILENAME}. {e}")
         return []
 
-def get_devices_for_account(email, password, job_name):
+def create_session():
+    """Creates a keep-alive HTTP/2 client shared by every account lookup."""
+    limits = httpx.Limits(max_keepalive_connections=10, keepalive_expiry=300)
+    transport = httpx.HTTPTransport(http2=True, retries=2, limits=limits)
+    return httpx.Client(transport=transport, timeout=15.0, follow_redirects=True)
+
+def get_with_retry(session, url, **kwargs):
+    """
+    GET that retries transient 502/503/504 answers with a short backoff;
+    the transport itself only retries failed connects.
+    """
+    for attempt in range(HTTP_STATUS_RETRIES):
+        response = session.get(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES:
+            return response
+        time.sleep(HTTP_RETRY_BACKOFF * (2 ** attempt))
+    return session.get(url, **kwargs)
+
+def get_devices_for_account(session, email, password, job_name):
     """Logs into an account and fetches its device list."""
     print(f"\n>>> Checking Job: {job_name} ({email})")
     
@@ -27,7 +49,7 @@ def get_devices_for_account(email, password, job_name):
     try:
         # Note: API expects form-data (application/x-www-form-urlencoded)
         payload = {'email': email, 'password': password}
-        response = requests.post(LOGIN_URL, data=payload, timeout=15)
+        response = session.post(LOGIN_URL, data=payload, timeout=15)
         
         if response.status_code != 200:
             print(f"    [!] Login Failed. Status: {response.status_code}")
@@ -42,7 +64,7 @@ def get_devices_for_account(email, password, job_name):
 
         # 2. Fetch all devices
         headers = {'Authorization': f'bearer {token}'}
-        dev_res = requests.get(DEVICE_URL, headers=headers, timeout=15)
+        dev_res = get_with_retry(session, DEVICE_URL, headers=headers, timeout=15)
         
         if dev_res.status_code == 200:
             devices = dev_res.json().get('data', [])
@@ -71,6 +93,8 @@ def main():
         print("No jobs found in config.")
         return
 
+    session = create_session()
+
     for job in config:
         # Extract credentials from the 'api' block of each job
         api_info = job.get('api', {})
@@ -79,7 +103,7 @@ def main():
         job_name = job.get('job_name', 'Unnamed Job')
         
         if email and password:
-            get_devices_for_account(email, password, job_name)
+            get_devices_for_account(session, email, password, job_name)
         else:
             print(f"\n>>> Skipping Job: {job_name} (Missing credentials)")
 
@@ -24,7 +24,9 @@
             packages = with pkgs; [
               python312
               python312Packages.paho-mqtt
-              python312Packages.requests
+              python312Packages.httpx
+              python312Packages.h2
+              python312Packages.orjson
               mosquitto
             ];
           };